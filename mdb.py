@@ -1,5 +1,6 @@
 import os
 import re
+import pickle
 from pprint import pprint
 import sys
 import readline
@@ -207,8 +208,18 @@ def interpret_meta(command):
         [print(fold.removesuffix('_db')) for fold in os.listdir('dbdata')]
     
     def list_tables(db_name):
-        [print(pklf.removesuffix('.pkl')) for pklf in os.listdir(f'dbdata/{db_name}_db') if pklf.endswith('.pkl')\
-            and not pklf.startswith('meta')]
+        if db_name == db._name:
+            # the current database can have tables that are not saved yet
+            if not db._snapshot_is_current():
+                db.load_database()
+            tables = db.tables
+        elif os.path.isfile(f'dbdata/{db_name}_db/db.pkl'):
+            with open(f'dbdata/{db_name}_db/db.pkl', 'rb') as f:
+                tables = pickle.load(f)
+        else:
+            # databases saved by older versions have one pkl file per table
+            tables = [file.split('.')[0] for file in os.listdir(f'dbdata/{db_name}_db') if file.endswith('.pkl')]
+        [print(table_name) for table_name in tables if not table_name.startswith('meta')]
 
     def change_db(db_name):
         global db
@@ -234,12 +245,17 @@ if __name__ == "__main__":
     db = Database(dbname, load=True)
 
     if fname is not None:
-        for line in open(fname, 'r').read().splitlines():
-            if line.startswith('--'): continue
-            dic = interpret(line.lower())
-            result = execute_dic(dic)
-            if isinstance(result,Table):
-                result.show()
+        # save once, after the whole file has been executed
+        db.begin()
+        try:
+            for line in open(fname, 'r').read().splitlines():
+                if line.startswith('--'): continue
+                dic = interpret(line.lower())
+                result = execute_dic(dic)
+                if isinstance(result,Table):
+                    result.show()
+        finally:
+            db.commit()
     else:
         from prompt_toolkit import PromptSession
         from prompt_toolkit.history import FileHistory
@@ -1,6 +1,23 @@
 '''
 https://en.wikipedia.org/wiki/B%2B_tree
 '''
+import math
+from array import array
+
+def _int_array(ints):
+    '''
+    Return the ints as an array of the smallest (signed) type that can hold them.
+
+    Args:
+        ints: list. The ints to be stored.
+    '''
+    low, high = min(ints, default=0), max(ints, default=0)
+    for typecode in 'bhiq':
+        bound = 1 << (8*array(typecode).itemsize - 1)
+        if -bound <= low and high < bound:
+            return array(typecode, ints)
+    return array('q', ints)
+
 
 class Node:
     '''
@@ -96,6 +113,98 @@ class Btree:
         self.nodes = [] # list of nodes. Every new node is appended here
         self.root = None # the index of the root node
 
+    def __getstate__(self):
+        '''
+        Return the state that is pickled. Instead of one object per node, the nodes are stored as a few flat
+        sequences: all values and all ptrs (level by level, node by node), the number of each per node and the
+        sibling/parent indexes of each node (-1 for None).
+        '''
+        nodes = self.nodes
+        return {'b': self.b, 'root': self.root,
+                'values': [value for node in nodes for value in node.values],
+                'ptrs': _int_array([ptr for node in nodes for ptr in node.ptrs]),
+                'n_values': _int_array([len(node.values) for node in nodes]),
+                'n_ptrs': _int_array([len(node.ptrs) for node in nodes]),
+                'links': _int_array([-1 if link is None else link for node in nodes\
+                                     for link in (node.left_sibling, node.right_sibling, node.parent)]),
+                'is_leaf': bytes(node.is_leaf for node in nodes)}
+
+    def __setstate__(self, state):
+        '''
+        Rebuild the tree from the state returned by __getstate__.
+
+        Args:
+            state: dict. The unpickled state.
+        '''
+        if 'nodes' in state: # pickled before the flat layout was introduced
+            self.__dict__.update(state)
+            return
+
+        self.b = state['b']
+        self.root = state['root']
+        self.nodes = []
+        values, ptrs, links = state['values'], state['ptrs'].tolist(), state['links'].tolist()
+        v = p = 0
+        for i, (n_values, n_ptrs) in enumerate(zip(state['n_values'], state['n_ptrs'])):
+            left, right, parent = (None if link==-1 else link for link in links[3*i:3*i+3])
+            self.nodes.append(Node(self.b, values[v:v+n_values], ptrs[p:p+n_ptrs],\
+                                   left_sibling=left, right_sibling=right, parent=parent, is_leaf=bool(state['is_leaf'][i])))
+            v += n_values
+            p += n_ptrs
+
+    @classmethod
+    def bulk_load(cls, b, items, fill=0.75):
+        '''
+        Build a tree bottom-up from (value, ptr) pairs that are already sorted by value.
+        Leaves are packed to the given fill factor, then each level of parents is built on top of
+        the previous one until a single root remains.
+
+        Args:
+            b: int. The branching factor.
+            items: list. (value, ptr) pairs, sorted by value (values must be unique).
+            fill: float. Fraction of a node's capacity that is filled (rounded up, so with a small branching
+                  factor, e.g. b=3, the nodes are full and the next insert into a node splits it).
+        '''
+        bt = cls(b)
+        if not items:
+            return bt
+
+        def chunks(seq, size):
+            # split seq into ceil(len/size) groups of (almost) equal length
+            n_groups = -(-len(seq)//size)
+            step, extra = divmod(len(seq), n_groups)
+            start = 0
+            for i in range(n_groups):
+                end = start + step + (1 if i < extra else 0)
+                yield seq[start:end]
+                start = end
+
+        # leaves hold at most b-1 values
+        leaf_size = max(1, math.ceil(fill*(b-1)))
+        level = [] # (node index, smallest value under that node) for the level being built
+        for group in chunks(items, leaf_size):
+            idx = len(bt.nodes)
+            bt.nodes.append(Node(b, [value for value, _ in group], [ptr for _, ptr in group],\
+                                 left_sibling=idx-1 if level else None, is_leaf=True))
+            if level:
+                bt.nodes[idx-1].right_sibling = idx
+            level.append((idx, group[0][0]))
+
+        # non leaf nodes have at most b ptrs. The value separating two children is the smallest value of the right one
+        node_size = max(2, math.ceil(fill*b))
+        while len(level) > 1:
+            parents = []
+            for group in chunks(level, node_size):
+                idx = len(bt.nodes)
+                bt.nodes.append(Node(b, [low for _, low in group[1:]], [child for child, _ in group], is_leaf=False))
+                for child, _ in group:
+                    bt.nodes[child].parent = idx
+                parents.append((idx, group[0][1]))
+            level = parents
+
+        bt.root = level[0][0]
+        return bt
+
     def insert(self, value, ptr, rptr=None):
         '''
         Insert the value and its ptr/s to the appropriate node (node-level insertion is covered by the node object).
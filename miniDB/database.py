@@ -1,9 +1,13 @@
 from __future__ import annotations
 import pickle
+import csv
 from table import Table
 from time import sleep, localtime, strftime
 import os,sys
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor
 from btree import Btree
+from sorted_index import SortedIndex
 import shutil
 from misc import split_condition
 import logging
@@ -22,11 +26,49 @@ class Database:
     Main Database class, containing tables.
     '''
 
-    def __init__(self, name, load=True):
+    def __init__(self, name, load=True, durable=True):
         self.tables = {}
         self._name = name
+        # the internal meta tables (they are never locked and their deleted rows are removed instead of emptied)
+        self._meta_tables = frozenset({'meta_length', 'meta_locks', 'meta_insert_stack', 'meta_indexes'})
+        # if False, save_database does not fsync db.pkl (only commit does)
+        self.durable = durable
+        # True once the in-memory tables are the most recent version of the database
+        self._loaded = False
+        # while True, saves are deferred until commit is called (see begin/commit)
+        self._in_transaction = False
+        # if False, the database has no triggers and the trigger checks of insert/update/delete are skipped
+        self._has_any_triggers = False
+        # table_name -> name of the index on its primary key (mirrors the meta_indexes table, see _update_index_mirrors)
+        self._index_by_table = {}
+        # names of all indexes (mirrors the index_name column of the meta_indexes table, see _update_index_mirrors)
+        self._index_names = set()
+        # meta table name -> {table_name: position of its record in the meta table} (see _meta_rows)
+        self._meta_row_by_name = {}
+        # table_name -> indices of deleted rows not yet written to meta_insert_stack (see _flush_insert_stacks)
+        self._pending_insert_stack = {}
+        # names of the tables modified since meta_length was last updated (see _update_meta_length)
+        self._dirty_tables = set()
 
         self.savedir = f'dbdata/{name}_db'
+        # all tables are stored in a single file. meta_locks is also stored separately (see _save_locks)
+        self._manifest_path = f'{self.savedir}/db.pkl'
+        self._locks_path = f'{self.savedir}/meta_locks.pkl'
+        self._indexes_dir = f'{self.savedir}/indexes'
+        # index files are written in the background (see _save_index). Pending writes are awaited by
+        # save_database and before an index is read
+        self._save_executor = ThreadPoolExecutor(max_workers=1)
+        self._pending_index_saves = []
+        # paths of the index files that have been written without fsync (they are fsynced by the next synced save)
+        self._unsynced_index_paths = set()
+        # index_name -> ((mtime, size) of the index file, index object) for the indexes read by _load_idx
+        self._idx_cache = {}
+        # (mtime, size) of meta_locks.pkl when it was last read/written by this object
+        self._locks_stat = None
+        # (mtime, size) of db.pkl when it was last loaded/saved by this object
+        self._manifest_stat = None
+        # table_name -> pid of the process that holds its lock (mirrors the meta_locks table)
+        self._lock_pids = {}
 
         if load:
             try:
@@ -56,40 +98,136 @@ class Database:
         self.create_table('triggers','trigger_name,trigger_table,action,when','str,str,str,str','trigger_name')
         
         self.save_database()
+        self._save_locks()
+        self._loaded = True
 
-    def save_database(self):
+    def save_database(self, sync=None):
         '''
         Save database as a pkl file. This method saves the database object, including all tables and attributes.
+        All tables are pickled to a temporary file in a single dump, which then atomically replaces db.pkl
+        (a crash during the save never leaves a partially written db.pkl).
+        Inside a transaction (see begin), the save is deferred until commit.
+
+        Args:
+            sync: boolean. If True, db.pkl and the index files are fsynced before db.pkl is replaced. If None, the durable attribute is used.
         '''
-        for name, table in self.tables.items():
-            with open(f'{self.savedir}/{name}.pkl', 'wb') as f:
-                pickle.dump(table, f)
+        if self._in_transaction:
+            return
+
+        self._flush_insert_stacks()
+        if sync is None:
+            sync = self.durable
+        # the index files are written before db.pkl is replaced, so a saved db.pkl never refers to a missing index file
+        self._wait_for_index_saves(sync)
+
+        tmp_path = f'{self._manifest_path}.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(self.tables, f, protocol=pickle.HIGHEST_PROTOCOL)
+            f.flush()
+            if sync:
+                os.fsync(f.fileno())
+            st = os.fstat(f.fileno())
+        os.replace(tmp_path, self._manifest_path)
+        self._manifest_stat = (st.st_mtime_ns, st.st_size)
 
     def _save_locks(self):
         '''
         Stores the meta_locks table to file as meta_locks.pkl.
         '''
-        with open(f'{self.savedir}/meta_locks.pkl', 'wb') as f:
-            pickle.dump(self.tables['meta_locks'], f)
+        with open(self._locks_path, 'wb') as f:
+            pickle.dump(self.tables['meta_locks'], f, protocol=pickle.HIGHEST_PROTOCOL)
+            f.flush()
+            st = os.fstat(f.fileno())
+        self._locks_stat = (st.st_mtime_ns, st.st_size)
+        self._meta_row_by_name.pop('meta_locks', None)
+
+    def _load_locks(self):
+        '''
+        Loads the meta_locks table from meta_locks.pkl. The file is only read if it has been
+        modified (by another process) since it was last read or written.
+        '''
+        st = os.stat(self._locks_path)
+        if (st.st_mtime_ns, st.st_size) == self._locks_stat:
+            return
+        with open(self._locks_path, 'rb') as f:
+            self.tables.update({'meta_locks': pickle.load(f)})
+        self._locks_stat = (st.st_mtime_ns, st.st_size)
+        self._meta_row_by_name.pop('meta_locks', None)
+        self._lock_pids = {table_name: pid for table_name, pid, _ in self.tables['meta_locks'].data}
 
     def load_database(self):
         '''
         Load all tables that are part of the database (indices noted here are loaded).
-
-        Args:
-            path: string. Directory (path) of the database on the system.
         '''
-        path = f'dbdata/{self._name}_db'
-        for file in os.listdir(path):
-
+        # databases saved by older versions have one pkl file per table
+        if not os.path.isfile(self._manifest_path) and os.path.isdir(self.savedir):
+            self._migrate_legacy_database()
+
+        with open(self._manifest_path, 'rb') as f:
+            self.tables = pickle.load(f)
+            st = os.fstat(f.fileno())
+        self._manifest_stat = (st.st_mtime_ns, st.st_size)
+
+        # meta_locks.pkl is written on every lock/unlock, so it is more recent than the copy in db.pkl
+        if os.path.isfile(self._locks_path):
+            self._locks_stat = None
+            self._load_locks()
+        self._update_has_any_triggers()
+        self._meta_row_by_name = {}
+        self._pending_insert_stack = {}
+        self._dirty_tables = set()
+        self._update_index_mirrors()
+        self._loaded = True
+
+    def _migrate_legacy_database(self):
+        '''
+        Convert a database that is saved as one pkl file per table to a single db.pkl file.
+        The per-table files are removed after db.pkl is saved (meta_locks.pkl is kept).
+        '''
+        tables = {}
+        for file in os.listdir(self.savedir):
             if file[-3:]!='pkl': # if used to load only pkl files
                 continue
-            f = open(path+'/'+file, 'rb')
-            tmp_dict = pickle.load(f)
-            f.close()
-            name = f'{file.split(".")[0]}'
-            self.tables.update({name: tmp_dict})
-            # setattr(self, name, self.tables[name])
+            with open(f'{self.savedir}/{file}', 'rb') as f:
+                tables[file.split('.')[0]] = pickle.load(f)
+
+        if not tables:
+            return
+
+        self.tables = tables
+        self.save_database()
+        for name in tables:
+            if name!='meta_locks':
+                os.remove(f'{self.savedir}/{name}.pkl')
+        logging.info(f'Migrated "{self._name}" to a single db.pkl file.')
+
+    def _snapshot_is_current(self):
+        '''
+        Check whether the in-memory tables are the most recent version of the database, i.e. the database
+        has been loaded and db.pkl has not been written by another process since it was last loaded/saved.
+        Used to skip reloading the database on every query.
+        '''
+        if not self._loaded:
+            return False
+        # inside a transaction the in-memory tables are newer than db.pkl and must not be replaced
+        if self._in_transaction:
+            return True
+        st = os.stat(self._manifest_path)
+        return (st.st_mtime_ns, st.st_size) == self._manifest_stat
+
+    def begin(self):
+        '''
+        Start a transaction. Until commit is called, queries only modify the in-memory tables
+        and the database is not saved (useful when executing many queries, e.g. an sql file).
+        '''
+        self._in_transaction = True
+
+    def commit(self):
+        '''
+        End the current transaction and save the database once (always fsynced, even if the database is not durable).
+        '''
+        self._in_transaction = False
+        self.save_database(sync=True)
 
     #### TRIGGERS ####
     def create_trigger(self,trigger_name=None,table_name=None,when=None,action=None):
@@ -107,7 +245,8 @@ class Database:
                 AFTER: trigger is fired after query runs.
         '''
         
-        self.load_database()
+        if not self._snapshot_is_current():
+            self.load_database()
         
         # name of trigger can not be ""
         if trigger_name=='':
@@ -130,9 +269,10 @@ class Database:
 
 
         # check if trigger to be created is on an existing table of the DB
-        if table_name in self.tables.keys() and table_name!='triggers':
+        if table_name in self.tables and table_name!='triggers':
             # add a new row to 'triggers' table
             self.insert_into('triggers',trigger_name+','+table_name+','+action+','+when,True)
+            self._update_has_any_triggers()
         else:
             print('You can not create a trigger on this table!')
 
@@ -145,10 +285,12 @@ class Database:
             trigger_name: string. The name of the trigger to be deleted.
         '''
         
-        self.load_database()
+        if not self._snapshot_is_current():
+            self.load_database()
 
         # remove a row from 'triggers' table
         self.delete_from('triggers','trigger_name='+trigger_name,True)
+        self._update_has_any_triggers()
 
     def check_for_triggers(self,trigger_table,action,when):
 
@@ -157,30 +299,27 @@ class Database:
         in this project, every trigger executes the same function. In a database, there can exist
         many triggers on a specific table (ex. instructor) that are fired after a specific event
         (ex. update). So, in this method, it is counted how many times a trigger with the same action
-        on the same table exists in the 'triggers' table
+        on the same table exists in the 'triggers' table.
+        The counts are kept in a hash index of the 'triggers' table (rebuilt only after the table changes),
+        so this is a single dict lookup.
 
         Args:
             trigger_table: string. The name of the table that trigger corresponds to.
             action: string. The action of the trigger.
             when: string. Time, in which trigger is going to be fired.
         '''
-        
-        '''
-        take the data of the second,third and fourth column of 
-        'triggers' table and store them in the lists below
-        '''
-        list_tables = self.tables['triggers'].column_by_name('trigger_table')
-        list_actions = self.tables['triggers'].column_by_name('action')
-        list_when = self.tables['triggers'].column_by_name('when')
+        trigger_counts = self.tables['triggers']._hash_index(('trigger_table', 'action', 'when'))
 
-        counter = 0 
+        # return the number of times that a specific trigger exists
+        return trigger_counts[(trigger_table, action, when)]
 
-        # check if trigger exists with specific values (trigger_table, action and when)
-        for x in range(len(list_tables)):
-            if list_tables[x]==trigger_table and list_actions[x]==action and list_when[x]==when: 
-                counter+=1 # if exist, then increase counter by 1
-        
-        return counter # return the number of times that a specific trigger exists
+    def _update_has_any_triggers(self):
+        '''
+        Check whether the 'triggers' table contains any trigger. Executed after the 'triggers' table is loaded or modified.
+        '''
+        trigger_counts = self.tables['triggers']._hash_index(('trigger_table', 'action', 'when'))
+        # deleted rows are counted under (None, None, None)
+        self._has_any_triggers = any(trigger_table is not None for trigger_table, _, _ in trigger_counts)
 
     
     def trigger_function(self,event,when):
@@ -199,10 +338,13 @@ class Database:
 
     def _update(self):
         '''
-        Update all meta tables.
+        Update all meta tables. Only the records of the tables modified since the last update are refreshed (see _dirty_tables).
         '''
-        self._update_meta_length()
-        self._update_meta_insert_stack()
+        tables = [self.tables[name] for name in self._dirty_tables if name in self.tables and not name.startswith('meta')]
+        self._dirty_tables.clear()
+        # the insert stacks are registered first, since the number of rows is computed from them
+        self._update_meta_insert_stack(tables)
+        self._update_meta_length(tables)
 
 
     def create_table(self, name, column_names, column_types, primary_key=None, load=None):
@@ -222,6 +364,7 @@ class Database:
         # self._name = Table(name=name, column_names=column_names, column_types=column_types, load=load)
         # check that new dynamic var doesnt exist already
         # self.no_of_tables += 1
+        self._dirty_tables.add(name)
         self._update()
         self.save_database()
         # (self.tables[name])
@@ -241,17 +384,20 @@ class Database:
             print('You can not drop this table!')
             return
 
-        self.load_database()
+        if not self._snapshot_is_current():
+            self.load_database()
         self.lock_table(table_name)
 
         self.tables.pop(table_name)
-        if os.path.isfile(f'{self.savedir}/{table_name}.pkl'):
-            os.remove(f'{self.savedir}/{table_name}.pkl')
-        else:
-            warnings.warn(f'"{self.savedir}/{table_name}.pkl" not found.')
-        self.delete_from('meta_locks', f'table_name={table_name}')
-        self.delete_from('meta_length', f'table_name={table_name}')
-        self.delete_from('meta_insert_stack', f'table_name={table_name}')
+        # the table only exists in db.pkl, so the meta tables are cleaned directly
+        # (delete_from would reload the database, bringing the dropped table back)
+        self.tables['meta_locks']._delete_where(f'table_name={table_name}')
+        self._lock_pids.pop(table_name, None)
+        self._save_locks()
+        self.tables['meta_length']._delete_where(f'table_name={table_name}')
+        self.tables['meta_insert_stack']._delete_where(f'table_name={table_name}')
+        self._pending_insert_stack.pop(table_name, None)
+        self._meta_row_by_name = {} # records of meta tables are removed (not blanked), so the positions have shifted
 
         # self._update()
         self.save_database()
@@ -266,24 +412,16 @@ class Database:
             column_types: list. Types of columns. If not specified, all will be set to type str.
             primary_key: string. The primary key (if it exists).
         '''
-        file = open(filename, 'r')
-
-        first_line=True
-        for line in file.readlines():
-            if first_line:
-                colnames = line.strip('\n')
-                if column_types is None:
-                    column_types = ",".join(['str' for _ in colnames.split(',')])
-                self.create_table(name=table_name, column_names=colnames, column_types=column_types, primary_key=primary_key)
-                lock_ownership = self.lock_table(table_name, mode='x')
-                first_line = False
-                continue
-            self.tables[table_name]._insert(line.strip('\n').split(','))
+        with open(filename, 'r', newline='') as file:
+            reader = csv.reader(file)
 
-        if lock_ownership:
-             self.unlock_table(table_name)
-        self._update()
-        self.save_database()
+            colnames = ','.join(next(reader))
+            if column_types is None:
+                column_types = ",".join(['str' for _ in colnames.split(',')])
+            self.create_table(name=table_name, column_names=colnames, column_types=column_types, primary_key=primary_key)
+
+            # rows are read lazily and inserted in batches (empty lines are skipped)
+            self.insert_many(table_name, (row for row in reader if row))
 
 
     def export(self, table_name, filename=None):
@@ -294,15 +432,13 @@ class Database:
             table_name: string. Name of table.
             filename: string. Output CSV filename.
         '''
-        res = ''
-        for row in [self.tables[table_name].column_names]+self.tables[table_name].data:
-            res+=str(row)[1:-1].replace('\'', '').replace('"','').replace(' ','')+'\n'
-
         if filename is None:
             filename = f'{table_name}.csv'
 
-        with open(filename, 'w') as file:
-           file.write(res)
+        with open(filename, 'w', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow(self.tables[table_name].column_names)
+            writer.writerows(self.tables[table_name].data)
 
     def table_from_object(self, new_table):
         '''
@@ -317,6 +453,9 @@ class Database:
             setattr(self, new_table._name, new_table)
         else:
             raise Exception(f'"{new_table._name}" attribute already exists in class "{self.__class__.__name__}".')
+        # the table can contain rows filled with Nones (e.g. deleted rows copied by a select) that are not in its insert stack
+        new_table._insert_stack_exact = False
+        self._dirty_tables.add(new_table._name)
         self._update()
         self.save_database()
 
@@ -324,7 +463,7 @@ class Database:
 
     ##### table functions #####
 
-    # In every table function a load command is executed to fetch the most recent table.
+    # In every table function the database is loaded first, if the in-memory tables are not the most recent ones.
     # In every table function, we first check whether the table is locked. Since we have implemented
     # only the X lock, if the tables is locked we always abort.
     # After every table function, we update and save. Update updates all the meta tables and save saves all
@@ -342,10 +481,12 @@ class Database:
             column_name: string. The column that will be casted (must be part of database).
             cast_type: type. Cast type (do not encapsulate in quotes).
         '''
-        self.load_database()
+        if not self._snapshot_is_current():
+            self.load_database()
         
         lock_ownership = self.lock_table(table_name, mode='x')
         self.tables[table_name]._cast_column(column_name, eval(cast_type))
+        self._meta_table_modified(table_name)
         if lock_ownership:
             self.unlock_table(table_name)
         self._update()
@@ -365,10 +506,10 @@ class Database:
         
         # check if a row can be inserted to table
         # Note: 'triggers' table can not be modified from a simple insert query
-        if (table_name=='triggers' and flag) or table_name!='triggers':
+        if table_name!='triggers' or flag:
             
-            # check if exist BEFORE triggers with INSERT event
-            k = self.check_for_triggers(table_name,'insert','before')
+            # check if exist BEFORE triggers with INSERT event (skipped if the database has no triggers)
+            k = self.check_for_triggers(table_name,'insert','before') if self._has_any_triggers else 0
 
             # execute trigger's function
             for i in range(k):
@@ -381,13 +522,18 @@ class Database:
             trigger_flag = True 
 
             row = row_str.strip().split(',')
-            self.load_database()
+            if not self._snapshot_is_current():
+                self.load_database()
             # fetch the insert_stack. For more info on the insert_stack
             # check the insert_stack meta table
             lock_ownership = self.lock_table(table_name, mode='x')
             insert_stack = self._get_insert_stack_for_table(table_name)
             try:
                 self.tables[table_name]._insert(row, insert_stack)
+                self._dirty_tables.add(table_name)
+                # the last index of the stack has been filled (only if the row was inserted)
+                if insert_stack:
+                    insert_stack.pop()
                 print('Query is completed')
             except Exception as e:
                 
@@ -396,15 +542,13 @@ class Database:
                 
                 logging.info(e)
                 logging.info('ABORTED')
-            
-            self._update_meta_insert_stack_for_tb(table_name, insert_stack[:-1])
 
             if lock_ownership:
                 self.unlock_table(table_name)
             self._update()
             self.save_database()
 
-            if trigger_flag:
+            if trigger_flag and self._has_any_triggers:
                 # execute trigger if exists
                 n = self.check_for_triggers(table_name,'insert','after')
 
@@ -417,6 +561,53 @@ class Database:
         print('This table can not be modified!')
 
 
+    def insert_many(self, table_name, rows, batch=10000):
+        '''
+        Inserts multiple rows to given table. Useful for bulk-loading, since the table is locked,
+        the meta tables are updated and the database is saved once for all rows (instead of once per row).
+        Triggers are fired once per batch.
+
+        Args:
+            table_name: string. Name of table (must be part of database).
+            rows: iterable. Lists of values to be inserted (will be casted to a predifined type automatically).
+            batch: int. Number of rows inserted at once. If a row is not valid, its batch is not inserted and the
+                   exception is raised (the previous batches remain inserted).
+        '''
+        # Note: 'triggers' table can not be modified from a simple insert query
+        if table_name=='triggers':
+            print('This table can not be modified!')
+            return
+
+        if not self._snapshot_is_current():
+            self.load_database()
+
+        lock_ownership = self.lock_table(table_name, mode='x')
+        insert_stack = list(self._get_insert_stack_for_table(table_name))
+        rows = iter(rows)
+        try:
+            while True:
+                rows_batch = list(islice(rows, batch))
+                if not rows_batch:
+                    break
+
+                if self._has_any_triggers:
+                    for i in range(self.check_for_triggers(table_name,'insert','before')):
+                        self.trigger_function('insert','before')
+
+                self.tables[table_name]._insert_many(rows_batch, insert_stack)
+
+                if self._has_any_triggers:
+                    for i in range(self.check_for_triggers(table_name,'insert','after')):
+                        self.trigger_function('insert','after')
+        finally:
+            self._dirty_tables.add(table_name)
+            self._update_meta_insert_stack_for_tb(table_name, insert_stack)
+            if lock_ownership:
+                self.unlock_table(table_name)
+            self._update()
+            self.save_database()
+
+
     def update_table(self, table_name, set_args, condition,flag=False):
         '''
         Update the value of a column where a condition is met.
@@ -437,24 +628,28 @@ class Database:
         
         # check if a row can be updated in the table
         # Note: 'triggers' table can not be modified from a simple update query
-        if (table_name=='triggers' and flag) or table_name!='triggers':
+        if table_name!='triggers' or flag:
 
-            # check if exist BEFORE triggers with UPDATE event
-            k = self.check_for_triggers(table_name,'update','before')
+            # check if exist BEFORE triggers with UPDATE event (skipped if the database has no triggers)
+            k = self.check_for_triggers(table_name,'update','before') if self._has_any_triggers else 0
 
             # execute trigger's function
             for i in range(k):
                 self.trigger_function('update','before')
 
             set_column, set_value = set_args.replace(' ','').split('=')
-            self.load_database()
+            if not self._snapshot_is_current():
+                self.load_database()
             
             lock_ownership = self.lock_table(table_name, mode='x')
             changed = self.tables[table_name]._update_rows(set_value, set_column, condition)
+            self._meta_table_modified(table_name)
+            if changed:
+                self._dirty_tables.add(table_name)
             print('Query is completed')
 
             # if the query changed the table then check for triggers
-            if changed:
+            if changed and self._has_any_triggers:
                 
                 # execute trigger
                 # stores the number of times that a specific trigger is being discovered
@@ -492,32 +687,34 @@ class Database:
         
         # check if a row can be deleted from table
         # Note: 'triggers' table can not be modified from a simple delete query
-        if (table_name=='triggers' and flag) or table_name!='triggers':
+        if table_name!='triggers' or flag:
 
-            # check if exist BEFORE triggers with DELETE event
-            k = self.check_for_triggers(table_name,'delete','before')
+            # check if exist BEFORE triggers with DELETE event (skipped if the database has no triggers)
+            k = self.check_for_triggers(table_name,'delete','before') if self._has_any_triggers else 0
 
             # execute trigger's function
             for i in range(k):
                 self.trigger_function('delete','before')
             
-            self.load_database()
+            if not self._snapshot_is_current():
+                self.load_database()
             
             lock_ownership = self.lock_table(table_name, mode='x')
             deleted = self.tables[table_name]._delete_where(condition)
+            self._meta_table_modified(table_name)
+            if deleted:
+                self._dirty_tables.add(table_name)
             print('Query is completed')
 
+            if table_name not in self._meta_tables:
+                self._add_to_insert_stack(table_name, deleted)
             if lock_ownership:
                 self.unlock_table(table_name)
             self._update()
             self.save_database()
-            # we need the save above to avoid loading the old database that still contains the deleted elements
-            if table_name[:4]!='meta':
-                self._add_to_insert_stack(table_name, deleted)
-            self.save_database()
             
             # if 'deleted' list is not empty, then scan for triggers
-            if bool(deleted): 
+            if bool(deleted) and self._has_any_triggers:
                 # execute triggers
                 n = self.check_for_triggers(table_name,'delete','after')
                 
@@ -567,7 +764,8 @@ class Database:
             distinct = True
 
         # print(table_name)
-        self.load_database()
+        if not self._snapshot_is_current():
+            self.load_database()
         if isinstance(table_name,Table):
             return table_name._select_where(columns, condition, distinct, order_by, desc, top_k)
 
@@ -581,7 +779,7 @@ class Database:
         if self.is_locked(table_name):
             return
         if self._has_index(table_name) and condition_column==self.tables[table_name].column_names[self.tables[table_name].pk_idx]:
-            index_name = self.select('*', 'meta_indexes', f'table_name={table_name}', return_object=True).column_by_name('index_name')[0]
+            index_name = self._index_by_table[table_name]
             bt = self._load_idx(index_name)
             table = self.tables[table_name]._select_where_with_btree(columns, bt, condition, order_by, desc, top_k)
         else:
@@ -604,7 +802,8 @@ class Database:
         Args:
             table_name: string. Name of table (must be part of database).
         '''
-        self.load_database()
+        if not self._snapshot_is_current():
+            self.load_database()
         
         self.tables[table_name].show(no_of_rows, self.is_locked(table_name))
 
@@ -619,10 +818,12 @@ class Database:
             asc: If True sort will return results in ascending order (False by default).
         '''
 
-        self.load_database()
+        if not self._snapshot_is_current():
+            self.load_database()
         
         lock_ownership = self.lock_table(table_name, mode='x')
         self.tables[table_name]._sort(column_name, asc=asc)
+        self._meta_table_modified(table_name)
         if lock_ownership:
             self.unlock_table(table_name)
         self._update()
@@ -643,7 +844,8 @@ class Database:
         save_as: string. The output filename that will be used to save the resulting table in the database (won't save if None).
         return_object: boolean. If True, the result will be a table object (useful for internal usage - the result will be printed by default).
         '''
-        self.load_database()
+        if not self._snapshot_is_current():
+            self.load_database()
         if self.is_locked(left_table) or self.is_locked(right_table):
             return
 
@@ -672,24 +874,21 @@ class Database:
         Args:
             table_name: string. Table name (must be part of database).
         '''
-        if table_name[:4]=='meta' or table_name not in self.tables.keys() or isinstance(table_name,Table):
+        if isinstance(table_name,Table) or table_name in self._meta_tables or table_name not in self.tables:
             return
 
-        with open(f'{self.savedir}/meta_locks.pkl', 'rb') as f:
-            self.tables.update({'meta_locks': pickle.load(f)})
+        self._load_locks()
 
-        try:
-            pid = self.tables['meta_locks']._select_where('pid',f'table_name={table_name}').data[0][0]
+        pid = self._lock_pids.get(table_name)
+        if pid is not None:
             if pid!=os.getpid():
                 raise Exception(f'Table "{table_name}" is locked by process with pid={pid}')
             else:
                 return False
 
-        except IndexError:
-            pass
-
         if mode=='x':
             self.tables['meta_locks']._insert([table_name, os.getpid(), mode])
+            self._lock_pids[table_name] = os.getpid()
         else:
             raise NotImplementedError
         self._save_locks()
@@ -703,18 +902,17 @@ class Database:
         Args:
             table_name: string. Table name (must be part of database).
         '''
-        if table_name not in self.tables.keys():
+        if table_name not in self.tables:
             raise Exception(f'Table "{table_name}" is not in database')
 
+        self._load_locks()
+
         if not force:
-            try:
-                # pid = self.select('*','meta_locks',  f'table_name={table_name}', return_object=True).data[0][1]
-                pid = self.tables['meta_locks']._select_where('pid',f'table_name={table_name}').data[0][0]
-                if pid!=os.getpid():
-                    raise Exception(f'Table "{table_name}" is locked by the process with pid={pid}')
-            except IndexError:
-                pass
+            pid = self._lock_pids.get(table_name)
+            if pid is not None and pid!=os.getpid():
+                raise Exception(f'Table "{table_name}" is locked by the process with pid={pid}')
         self.tables['meta_locks']._delete_where(f'table_name={table_name}')
+        self._lock_pids.pop(table_name, None)
         self._save_locks()
         # print(f'Unlocking table "{table_name}"')
 
@@ -725,19 +923,14 @@ class Database:
         Args:
             table_name: string. Table name (must be part of database).
         '''
-        if isinstance(table_name,Table) or table_name[:4]=='meta':  # meta tables will never be locked (they are internal)
+        if isinstance(table_name,Table) or table_name in self._meta_tables:  # meta tables will never be locked (they are internal)
             return False
 
-        with open(f'{self.savedir}/meta_locks.pkl', 'rb') as f:
-            self.tables.update({'meta_locks': pickle.load(f)})
-
-        try:
-            pid = self.tables['meta_locks']._select_where('pid',f'table_name={table_name}').data[0][0]
-            if pid!=os.getpid():
-                raise Exception(f'Table "{table_name}" is locked by the process with pid={pid}')
+        self._load_locks()
 
-        except IndexError:
-            pass
+        pid = self._lock_pids.get(table_name)
+        if pid is not None and pid!=os.getpid():
+            raise Exception(f'Table "{table_name}" is locked by the process with pid={pid}')
         return False
 
     def journal(idx = None):
@@ -757,43 +950,119 @@ class Database:
     # Important: Meta tables contain info regarding the NON meta tables ONLY.
     # i.e. meta_length will not show the number of rows in meta_locks etc.
 
-    def _update_meta_length(self):
+    def _meta_rows(self, meta_table):
+        '''
+        Returns a dict that maps every table name the specified meta table contains a record for to the position of that record.
+        The dict is built once and then kept up to date by the methods that add or remove records.
+
+        Args:
+            meta_table: string. Name of the meta table.
+        '''
+        if meta_table not in self._meta_row_by_name:
+            table_name_idx = self.tables[meta_table].column_names.index('table_name')
+            self._meta_row_by_name[meta_table] = {row[table_name_idx]: idx for idx, row in enumerate(self.tables[meta_table].data)}
+        return self._meta_row_by_name[meta_table]
+
+    def _meta_table_modified(self, table_name):
+        '''
+        Executed after a query (delete, update, cast or sort) modifies a table. If the table is a meta table, its records
+        can have been removed, moved or changed, so everything that mirrors it is brought back in sync: the record
+        positions cached by _meta_rows, the dirty tables (meta_length/meta_insert_stack), _index_by_table/_index_names
+        (meta_indexes) and meta_locks.pkl/_lock_pids (meta_locks).
+
+        Args:
+            table_name: string. Table name.
+        '''
+        if table_name not in self._meta_tables:
+            return
+        self._meta_row_by_name.pop(table_name, None)
+        if table_name in ('meta_length', 'meta_insert_stack'):
+            # any record can have been removed or changed, so the records of all tables are refreshed by the next _update
+            for table in self._non_meta_tables():
+                self._dirty_tables.add(table._name)
+                if table_name == 'meta_insert_stack':
+                    table._insert_stack_exact = False
+        elif table_name == 'meta_indexes':
+            self._update_index_mirrors()
+        elif table_name == 'meta_locks':
+            # the locks are read from meta_locks.pkl (see _load_locks), so the modified table is saved there too
+            self._save_locks()
+            self._lock_pids = {locked_table: pid for locked_table, pid, _ in self.tables['meta_locks'].data}
+
+    def _add_meta_record(self, meta_table, record):
+        '''
+        Appends a record (whose first value is a table name) to the specified meta table.
+
+        Args:
+            meta_table: string. Name of the meta table.
+            record: list. The record that will be inserted.
+        '''
+        self.tables[meta_table]._insert(record)
+        self._meta_rows(meta_table)[record[0]] = len(self.tables[meta_table].data)-1
+
+    def _non_meta_tables(self):
+        '''
+        Returns all tables of the database except for the meta tables.
+        '''
+        return [table for table in self.tables.values() if not table._name.startswith('meta')]
+
+    def _update_meta_length(self, tables=None):
         '''
         Updates the meta_length table.
+
+        Args:
+            tables: list. The tables whose records are updated (all non meta tables if None).
         '''
-        for table in self.tables.values():
-            if table._name[:4]=='meta': #skip meta tables
-                continue
-            if table._name not in self.tables['meta_length'].column_by_name('table_name'): # if new table, add record with 0 no. of rows
-                self.tables['meta_length']._insert([table._name, 0])
+        for table in self._non_meta_tables() if tables is None else tables:
+            meta_length_rows = self._meta_rows('meta_length')
+            if table._name not in meta_length_rows: # if new table, add record with 0 no. of rows
+                self._add_meta_record('meta_length', [table._name, 0])
 
             # the result needs to represent the rows that contain data. Since we use an insert_stack
-            # some rows are filled with Nones. We skip these rows.
-            non_none_rows = len([row for row in table.data if any(row)])
-            self.tables['meta_length']._update_rows(non_none_rows, 'no_of_rows', f'table_name={table._name}')
+            # some rows are filled with Nones. These are exactly the rows whose indices are in the insert_stack
+            # (once the stack of the table has been synced, see _sync_insert_stack).
+            if not getattr(table, '_insert_stack_exact', False):
+                self._sync_insert_stack(table)
+            non_none_rows = len(table.data) - len(self._get_insert_stack_for_table(table._name))
+            meta_length = self.tables['meta_length']
+            meta_length.data[meta_length_rows[table._name]][meta_length.column_names.index('no_of_rows')] = non_none_rows
             # self.update_row('meta_length', len(table.data), 'no_of_rows', 'table_name', '==', table._name)
 
+    def _sync_insert_stack(self, table):
+        '''
+        Adds the rows of a table that are filled with Nones but are missing from its insert stack to the stack, so that
+        its number of rows can be computed from the stack. This is done once for every table that is not known to have
+        an exact stack: tables added with table_from_object (a saved select can contain deleted rows) and tables saved
+        by older versions (a failed insert used to drop an index from the stack).
+
+        Args:
+            table: Table. A table of the database (its record in meta_insert_stack must exist).
+        '''
+        in_stack = set(self._get_insert_stack_for_table(table._name))
+        missing = [idx for idx, row in enumerate(table.data) if idx not in in_stack and all(value is None for value in row)]
+        self._add_to_insert_stack(table._name, missing)
+        table._insert_stack_exact = True
+
     def _update_meta_locks(self):
         '''
         Updates the meta_locks table.
         '''
-        for table in self.tables.values():
-            if table._name[:4]=='meta': #skip meta tables
-                continue
-            if table._name not in self.tables['meta_locks'].column_by_name('table_name'):
+        for table in self._non_meta_tables():
+            if table._name not in self._meta_rows('meta_locks'):
 
-                self.tables['meta_locks']._insert([table._name, False])
+                self._add_meta_record('meta_locks', [table._name, False])
                 # self.insert('meta_locks', [table._name, False])
 
-    def _update_meta_insert_stack(self):
+    def _update_meta_insert_stack(self, tables=None):
         '''
         Updates the meta_insert_stack table.
+
+        Args:
+            tables: list. The tables whose records are updated (all non meta tables if None).
         '''
-        for table in self.tables.values():
-            if table._name[:4]=='meta': #skip meta tables
-                continue
-            if table._name not in self.tables['meta_insert_stack'].column_by_name('table_name'):
-                self.tables['meta_insert_stack']._insert([table._name, []])
+        for table in self._non_meta_tables() if tables is None else tables:
+            if table._name not in self._meta_rows('meta_insert_stack'):
+                self._add_meta_record('meta_insert_stack', [table._name, []])
 
 
     def _add_to_insert_stack(self, table_name, indexes):
@@ -804,8 +1073,37 @@ class Database:
             table_name: string. Table name (must be part of database).
             indexes: list. The list of indices that will be added to the insert stack (the indices of the newly deleted elements).
         '''
-        old_lst = self._get_insert_stack_for_table(table_name)
-        self._update_meta_insert_stack_for_tb(table_name, old_lst+indexes)
+        # the indices are only collected here. They are written to meta_insert_stack in one go by
+        # _flush_insert_stacks (when the stack is read or the database is saved)
+        self._pending_insert_stack.setdefault(table_name, []).extend(indexes)
+
+    def _flush_insert_stacks(self):
+        '''
+        Writes the indices collected by _add_to_insert_stack to the meta_insert_stack table (one update per table).
+        Indices that are already in a stack are not added again.
+        '''
+        if not self._pending_insert_stack:
+            return
+        indexes_idx = self.tables['meta_insert_stack'].column_names.index('indexes')
+        for table_name, indexes in self._pending_insert_stack.items():
+            # the stored stack is extended in place. An index that is freed twice must appear only once in the stack
+            # (otherwise the stack keeps growing and the same row would be filled twice)
+            stack = self._insert_stack_row(table_name)[indexes_idx]
+            in_stack = set(stack)
+            for index in indexes:
+                if index not in in_stack:
+                    stack.append(index)
+                    in_stack.add(index)
+        self._pending_insert_stack = {}
+
+    def _insert_stack_row(self, table_name):
+        '''
+        Returns the record of meta_insert_stack that holds the insert stack of the specified table.
+
+        Args:
+            table_name: string. Table name (must be part of database).
+        '''
+        return self.tables['meta_insert_stack'].data[self._meta_rows('meta_insert_stack')[table_name]]
 
     def _get_insert_stack_for_table(self, table_name):
         '''
@@ -814,7 +1112,8 @@ class Database:
         Args:
             table_name: string. Table name (must be part of database).
         '''
-        return self.tables['meta_insert_stack']._select_where('*', f'table_name={table_name}').column_by_name('indexes')[0]
+        self._flush_insert_stacks()
+        return self._insert_stack_row(table_name)[self.tables['meta_insert_stack'].column_names.index('indexes')]
         # res = self.select('meta_insert_stack', '*', f'table_name={table_name}', return_object=True).indexes[0]
         # return res
 
@@ -826,7 +1125,7 @@ class Database:
             table_name: string. Table name (must be part of database).
             new_stack: string. The stack that will be used to replace the existing one.
         '''
-        self.tables['meta_insert_stack']._update_rows(new_stack, 'indexes', f'table_name={table_name}')
+        self._insert_stack_row(table_name)[self.tables['meta_insert_stack'].column_names.index('indexes')] = new_stack
 
 
     # indexes
@@ -839,37 +1138,68 @@ class Database:
             table_name: string. Table name (must be part of database).
             index_name: string. Name of the created index.
         '''
-        if self.tables[table_name].pk_idx is None: # if no primary key, no index
-            raise Exception('Cannot create index. Table has no primary key.')
-        if index_name not in self.tables['meta_indexes'].column_by_name('index_name'):
-            # currently only btree is supported. This can be changed by adding another if.
-            if index_type=='btree':
-                logging.info('Creating Btree index.')
-                # insert a record with the name of the index and the table on which it's created to the meta_indexes table
-                self.tables['meta_indexes']._insert([table_name, index_name])
-                # crate the actual index
-                self._construct_index(table_name, index_name)
-                self.save_database()
-        else:
-            raise Exception('Cannot create index. Another index with the same name already exists.')
+        self.create_indexes([(index_name, table_name, index_type)])
+
+    def create_indexes(self, specs):
+        '''
+        Creates multiple indexes (see create_index). The database is saved once, after all indexes are created.
+        If an index cannot be created, the exception is raised (the previous indexes remain created).
+
+        Args:
+            specs: list. (index_name, table_name, index_type) tuples, one for each index.
+        '''
+        try:
+            for index_name, table_name, index_type in specs:
+                if self.tables[table_name].pk_idx is None: # if no primary key, no index
+                    raise Exception('Cannot create index. Table has no primary key.')
+                if index_name not in self._index_names:
+                    # currently only btree is supported. This can be changed by adding another if.
+                    if index_type=='btree':
+                        logging.info('Creating Btree index.')
+                        # insert a record with the name of the index and the table on which it's created to the meta_indexes table
+                        self.tables['meta_indexes']._insert([table_name, index_name])
+                        self._index_by_table.setdefault(table_name, index_name)
+                        self._index_names.add(index_name)
+                        # crate the actual index
+                        self._construct_index(table_name, index_name)
+                else:
+                    raise Exception('Cannot create index. Another index with the same name already exists.')
+        finally:
+            self.save_database()
 
     def _construct_index(self, table_name, index_name):
         '''
-        Construct a btree on a table and save.
+        Construct a btree (or a SortedIndex if the primary key is numeric) on a table and save.
 
         Args:
             table_name: string. Table name (must be part of database).
             index_name: string. Name of the created index.
         '''
-        bt = Btree(3) # 3 is arbitrary
-
-        # for each record in the primary key of the table, insert its value and index to the btree
-        for idx, key in enumerate(self.tables[table_name].column_by_name(self.tables[table_name].pk)):
-            bt.insert(key, idx)
+        # sort the (value, index) pairs of the primary key of the table once.
+        # empty rows (left behind by deletes) are not indexed
+        table = self.tables[table_name]
+        pk_idx = table.pk_idx
+        items = sorted((row[pk_idx], idx) for idx, row in enumerate(table.data) if row[pk_idx] is not None)
+        if table.column_types[pk_idx] in (int, float):
+            # numeric keys are kept in a sorted array, searched with binary search
+            bt = SortedIndex(items)
+        else:
+            # build the btree bottom-up
+            bt = Btree.bulk_load(3, items) # 3 is arbitrary
         # save the btree
         self._save_index(index_name, bt)
 
 
+    def _update_index_mirrors(self):
+        '''
+        Rebuild _index_by_table and _index_names from the meta_indexes table. Executed after the meta_indexes table is loaded or modified.
+        '''
+        self._index_by_table = {}
+        self._index_names = set()
+        for table_name, index_name in self.tables['meta_indexes'].data:
+            self._index_by_table.setdefault(table_name, index_name)
+            self._index_names.add(index_name)
+
     def _has_index(self, table_name):
         '''
         Check whether the specified table's primary key column is indexed.
@@ -877,7 +1207,7 @@ class Database:
         Args:
             table_name: string. Table name (must be part of database).
         '''
-        return table_name in self.tables['meta_indexes'].column_by_name('table_name')
+        return table_name in self._index_by_table
 
     def _save_index(self, index_name, index):
         '''
@@ -887,22 +1217,68 @@ class Database:
             index_name: string. Name of the created index.
             index: obj. The actual index object (btree object).
         '''
-        try:
-            os.mkdir(f'{self.savedir}/indexes')
-        except:
-            pass
+        os.makedirs(self._indexes_dir, exist_ok=True)
+        self._idx_cache.pop(index_name, None)
+        # the index is pickled by a background thread, so that the caller does not wait for the file to be written
+        self._pending_index_saves.append(self._save_executor.submit(self._write_index, f'{self._indexes_dir}/meta_{index_name}_index.pkl', index, self.durable))
 
-        with open(f'{self.savedir}/indexes/meta_{index_name}_index.pkl', 'wb') as f:
-            pickle.dump(index, f)
+    @staticmethod
+    def _write_index(path, index, sync):
+        '''
+        Pickle the index to a temporary file, which then atomically replaces the index file.
+
+        Args:
+            path: string. Path of the index file.
+            index: obj. The actual index object (btree object).
+            sync: boolean. If True, the file is fsynced before it replaces the index file.
+
+        Returns the path of the index file if it has not been fsynced (None otherwise).
+        '''
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'wb', buffering=1<<20) as f:
+            pickle.dump(index, f, protocol=pickle.HIGHEST_PROTOCOL)
+            f.flush()
+            if sync:
+                os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        return None if sync else path
+
+    def _wait_for_index_saves(self, sync=False):
+        '''
+        Wait until all index files submitted by _save_index are written (errors are raised here).
+
+        Args:
+            sync: boolean. If True, the index files that have been written without fsync are fsynced.
+        '''
+        pending, self._pending_index_saves = self._pending_index_saves, []
+        for future in pending:
+            unsynced_path = future.result()
+            if unsynced_path is not None:
+                self._unsynced_index_paths.add(unsynced_path)
+
+        if sync:
+            for path in self._unsynced_index_paths:
+                # the index can have been dropped since it was written
+                if os.path.isfile(path):
+                    with open(path, 'rb') as f:
+                        os.fsync(f.fileno())
+            self._unsynced_index_paths = set()
 
     def _load_idx(self, index_name):
         '''
-        Load and return the specified index.
+        Load and return the specified index. The index is only read if its file has been
+        modified since it was last read (otherwise the object that was read is returned).
 
         Args:
             index_name: string. Name of created index.
         '''
-        f = open(f'{self.savedir}/indexes/meta_{index_name}_index.pkl', 'rb')
-        index = pickle.load(f)
-        f.close()
+        self._wait_for_index_saves()
+        path = f'{self._indexes_dir}/meta_{index_name}_index.pkl'
+        st = os.stat(path)
+        cached = self._idx_cache.get(index_name)
+        if cached is not None and cached[0] == (st.st_mtime_ns, st.st_size):
+            return cached[1]
+        with open(path, 'rb', buffering=1<<20) as f:
+            index = pickle.load(f)
+        self._idx_cache[index_name] = ((st.st_mtime_ns, st.st_size), index)
         return index
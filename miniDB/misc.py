@@ -1,21 +1,42 @@
 import operator
+from functools import lru_cache
+
+OPERATORS = {'>': operator.gt,
+             '<': operator.lt,
+             '>=': operator.ge,
+             '<=': operator.le,
+             '=': operator.eq}
 
 def get_op(op, a, b):
     '''
     Get op as a function of a and b by using a symbol
     '''
-    ops = {'>': operator.gt,
-                '<': operator.lt,
-                '>=': operator.ge,
-                '<=': operator.le,
-                '=': operator.eq}
-
     try:
-        return ops[op](a,b)
+        return OPERATORS[op](a,b)
     except TypeError:  # if a or b is None (deleted record), python3 raises typerror
         return False
 
+def row_predicate(op, column_idx, value):
+    '''
+    Return a function that checks whether row[column_idx]"op"value holds for a given row.
+    The operator is resolved once, so the function can be applied to every row of a table.
+    '''
+    op_func = OPERATORS[op]
+
+    def predicate(row):
+        try:
+            return op_func(row[column_idx], value)
+        except TypeError:  # if the value is None (deleted record), python3 raises typerror
+            return False
+
+    return predicate
+
+@lru_cache(maxsize=256)
 def split_condition(condition):
+    '''
+    Split a condition to its left part, operator and right part.
+    The result is cached, since the same conditions are parsed repeatedly (e.g. table_name=... on the meta tables)
+    '''
     condition = condition.replace(' ','') # remove all whitespaces
     ops = {'>=': operator.ge,
            '<=': operator.le,
@@ -1,5 +1,6 @@
 import matplotlib.pyplot as plt
 import os
+import pickle
 import sys
 
 def preview(dirname='dbdata', plot=False):
@@ -13,6 +14,7 @@ def preview(dirname='dbdata', plot=False):
     plt.figure(figsize=(5, 5))
 
     table_flag = False
+    manifest_flag = os.path.isfile(dirname+'/db.pkl')
 
     labels = [name for name in os.listdir(dirname) if os.path.isdir(dirname+'/'+name)]
     if labels == []:
@@ -20,7 +22,15 @@ def preview(dirname='dbdata', plot=False):
         table_flag = True
     sizes = []
 
-    if table_flag:
+    if manifest_flag:
+        # all the tables of the database are saved in db.pkl, so the size of each table is its pickled size
+        with open(dirname+'/db.pkl', 'rb') as f:
+            tables = pickle.load(f)
+        labels = list(tables)
+        sizes = [len(pickle.dumps(table, protocol=pickle.HIGHEST_PROTOCOL)) for table in tables.values()]
+        plt.title('Total Table Size Distribution', fontsize=18)
+
+    elif table_flag:
         for table in labels:
             total_size = 0
             start_path = table
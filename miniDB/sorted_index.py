@@ -0,0 +1,53 @@
+'''
+Index for numeric primary keys: the keys are kept in a sorted array, next to the row index of each key.
+It can be used in place of a Btree (it has the same find method).
+'''
+from array import array
+from bisect import bisect_left, bisect_right
+
+
+class SortedIndex:
+    def __init__(self, items):
+        '''
+        The index abstraction.
+
+        Args:
+            items: list. (value, ptr) pairs, sorted by value. The values must be ints or floats.
+        '''
+        values = [value for value, _ in items]
+        # the values are stored in a typed array (8 bytes per value). Ints that do not fit in 64 bits are kept in a list.
+        typecode = 'd' if any(isinstance(value, float) for value in values) else 'q'
+        try:
+            self.values = array(typecode, values)
+        except OverflowError:
+            self.values = values
+        self.ptrs = array('q', [ptr for _, ptr in items]) # the indexes of each datapoint
+
+    def find(self, operator, value):
+        '''
+        Return ptrs of elements where index_value"operator"value (same as Btree.find).
+        Important, the user supplied "value" is the right value of the operation.
+
+        Args:
+            operator: string. The provided evaluation operator.
+            value: float. The value being searched for.
+        '''
+        # the position of the first value that is >= the user supplied value
+        left = bisect_left(self.values, value)
+
+        if operator == '=':
+            if left < len(self.values) and self.values[left] == value:
+                return [self.ptrs[left]]
+            return []
+        if operator == '>=':
+            return self.ptrs[left:].tolist()
+        if operator == '<':
+            return self.ptrs[:left].tolist()
+
+        # the position of the first value that is > the user supplied value
+        right = bisect_right(self.values, value, lo=left)
+        if operator == '>':
+            return self.ptrs[right:].tolist()
+        if operator == '<=':
+            return self.ptrs[:right].tolist()
+        return []
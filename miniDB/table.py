@@ -1,8 +1,10 @@
 from __future__ import annotations
+from collections import Counter
+from itertools import islice
 from tabulate import tabulate
 import pickle
 import os
-from misc import get_op, split_condition
+from misc import get_op, split_condition, row_predicate
 
 class Table:
     '''
@@ -64,6 +66,8 @@ class Table:
                 self.pk_idx = None
 
             self.pk = primary_key
+            # hash indexes built by _hash_index. They are dropped whenever the table is modified
+            self._hash_indexes = {}
             # self._update()
 
     # if any of the name, columns_names and column types are none. return an empty table object
@@ -73,6 +77,29 @@ class Table:
         return [row[self.column_names.index(column_name)] for row in self.data]
 
 
+    def _hash_index(self, column_names):
+        '''
+        Return a hash index (Counter) of the table, mapping each combination of values of the specified columns
+        to the number of rows that contain it. The index is built once and reused until the table is modified.
+
+        Args:
+            column_names: tuple. Names of the indexed columns.
+        '''
+        # tables saved before hash indexes were added do not have the attribute
+        if not hasattr(self, '_hash_indexes'):
+            self._hash_indexes = {}
+
+        if column_names not in self._hash_indexes:
+            column_idxs = [self.column_names.index(column_name) for column_name in column_names]
+            self._hash_indexes[column_names] = Counter(tuple(row[i] for i in column_idxs) for row in self.data)
+        return self._hash_indexes[column_names]
+
+    def _drop_hash_indexes(self):
+        '''
+        Drop all hash indexes (executed whenever the table is modified).
+        '''
+        self._hash_indexes = {}
+
     def _update(self):
         '''
         Update all the available columns with the appended rows.
@@ -96,6 +123,7 @@ class Table:
             self.data[i][column_idx] = cast_type(self.data[i][column_idx])
         # change the type of the column
         self.column_types[column_idx] = cast_type
+        self._drop_hash_indexes()
         # self._update()
 
     def _insert(self, row, insert_stack=[]):
@@ -127,8 +155,45 @@ class Table:
             self.data[insert_stack[-1]] = row
         else: # else append to the end
             self.data.append(row)
+        self._drop_hash_indexes()
         # self._update()
 
+    def _insert_many(self, rows, insert_stack=None):
+        '''
+        Insert multiple rows to table.
+        All rows are casted and checked before any of them is inserted, so either all or none of them are inserted.
+
+        Args:
+            rows: iterable. Lists of values to be inserted (will be casted to a predifined type automatically).
+            insert_stack: list. The insert stack (None by default). Rows are first placed at the indexes popped from its end,
+                          the rest are appended to the end of the table.
+        '''
+        no_of_columns = len(self.column_names)
+        # the values of the primary key column, kept in a set for fast duplicate checks
+        pk_values = set(self.column_by_name(self.pk)) if self.pk_idx is not None else None
+
+        new_rows = []
+        for row in rows:
+            if len(row)!=no_of_columns:
+                raise ValueError(f'ERROR -> Cannot insert {len(row)} values. Only {no_of_columns} columns exist')
+
+            # cast each value to the type of its column
+            row = [cast_type(value) for cast_type, value in zip(self.column_types, row)]
+
+            if pk_values is not None:
+                if row[self.pk_idx] in pk_values:
+                    raise ValueError(f'## ERROR -> Value {row[self.pk_idx]} already exists in primary key column.')
+                pk_values.add(row[self.pk_idx])
+
+            new_rows.append(row)
+
+        # fill the empty rows of the insert stack first, then append the rest to the end
+        no_of_filled = min(len(insert_stack), len(new_rows)) if insert_stack else 0
+        for row in new_rows[:no_of_filled]:
+            self.data[insert_stack.pop()] = row
+        self.data.extend(new_rows[no_of_filled:])
+        self._drop_hash_indexes()
+
     def _update_rows(self, set_value, set_column, condition):
         '''
         Update where Condition is met.
@@ -143,22 +208,23 @@ class Table:
                 Operatores supported: (<,<=,=,>=,>)
         '''
         # parse the condition
-        column_name, operator, value = self._parse_condition(condition)
+        condition_met = self._condition_predicate(condition)
 
-        # get the condition and the set column
-        column = self.column_by_name(column_name)
+        # get the set column
         set_column_idx = self.column_names.index(set_column)
 
         # set_columns_indx = [self.column_names.index(set_column_name) for set_column_name in set_column_names]
         
         changed = False # before the update, the table is not changed
         
-        # for each value in column, if condition, replace it with set_value
-        for row_ind, column_value in enumerate(column):
-            if get_op(operator, column_value, value):
-                self.data[row_ind][set_column_idx] = set_value
+        # for each row, if condition, replace the value of the set column with set_value
+        for row in self.data:
+            if condition_met(row):
+                row[set_column_idx] = set_value
                 changed = True # the table has been modified by the 'update' query
-        
+
+        if changed:
+            self._drop_hash_indexes()
         return changed
         
 
@@ -180,25 +246,23 @@ class Table:
                 
                 Operatores supported: (<,<=,==,>=,>)
         '''
-        column_name, operator, value = self._parse_condition(condition)
-
-        indexes_to_del = []
+        condition_met = self._condition_predicate(condition)
 
-        column = self.column_by_name(column_name)
-        for index, row_value in enumerate(column):
-            if get_op(operator, row_value, value):
-                indexes_to_del.append(index)
+        indexes_to_del = [index for index, row in enumerate(self.data) if condition_met(row)]
 
         # we pop from highest to lowest index in order to avoid removing the wrong item
         # since we dont delete, we dont have to to pop in that order, but since delete is used
         # to delete from meta tables too, we still implement it.
         for index in sorted(indexes_to_del, reverse=True):
-            if self._name[:4] != 'meta':
+            if not self._name.startswith('meta'):
                 # if the table is not a metatable, replace the row with a row of nones
                 self.data[index] = [None for _ in range(len(self.column_names))]
             else:
                 self.data.pop(index)
 
+        if indexes_to_del:
+            self._drop_hash_indexes()
+
         # self._update()
         # we have to return the deleted indexes, since they will be appended to the insert_stack
         return indexes_to_del
@@ -236,9 +300,8 @@ class Table:
         # if condition is None, return all rows
         # if not, return the rows with values where condition is met for value
         if condition is not None:
-            column_name, operator, value = self._parse_condition(condition)
-            column = self.column_by_name(column_name)
-            rows = [ind for ind, x in enumerate(column) if get_op(operator, x, value)] # create a list with the indexes of the rows to be returned
+            condition_met = self._condition_predicate(condition)
+            rows = [ind for ind, row in enumerate(self.data) if condition_met(row)] # create a list with the indexes of the rows to be returned
             
         else:
             rows = [i for i in range(len(self.data))]
@@ -290,6 +353,7 @@ class Table:
         # only return some columns
         dict['column_names'] = [self.column_names[i] for i in return_cols]
         dict['column_types']   = [self.column_types[i] for i in return_cols]
+        dict['_hash_indexes'] = {}
         
         s_table = Table(load=dict) 
         if order_by:
@@ -336,6 +400,7 @@ class Table:
 
         dict['column_names'] = [self.column_names[i] for i in return_cols]
         dict['column_types']   = [self.column_types[i] for i in return_cols]
+        dict['_hash_indexes'] = {}
 
         s_table = Table(load=dict) 
         if order_by:
@@ -357,6 +422,7 @@ class Table:
         idx = sorted(range(len(column)), key=lambda k: column[k], reverse=desc)
         # print(idx)
         self.data = [self.data[i] for i in idx]
+        self._drop_hash_indexes()
         # self._update()
 
 
@@ -432,9 +498,10 @@ class Table:
             headers[self.pk_idx] = headers[self.pk_idx]+' #PK#'
         # detect the rows that are no tfull of nones (these rows have been deleted)
         # if we dont skip these rows, the returning table has empty rows at the deleted positions
-        non_none_rows = [row for row in self.data if any(row)]
+        # only the rows that will be printed are collected (the scan stops after no_of_rows rows)
+        non_none_rows = list(islice(filter(any, self.data), no_of_rows))
         # print using tabulate
-        print(tabulate(non_none_rows[:no_of_rows], headers=headers)+'\n')
+        print(tabulate(non_none_rows, headers=headers)+'\n')
 
 
     def _parse_condition(self, condition, join=False):
@@ -462,6 +529,21 @@ class Table:
         return left, op, coltype(right)
 
 
+    def _condition_predicate(self, condition):
+        '''
+        Parse the condition once and return a function that checks whether a row meets it.
+
+        Args:
+            condition: string. A condition using the following format:
+                'column[<,<=,==,>=,>]value' or
+                'value[<,<=,==,>=,>]column'.
+                
+                Operatores supported: (<,<=,==,>=,>)
+        '''
+        column_name, operator, value = self._parse_condition(condition)
+        return row_predicate(operator, self.column_names.index(column_name), value)
+
+
     def _load_from_file(self, filename):
         '''
         Load table from a pkl file (not used currently).